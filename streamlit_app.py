@@ -1,10 +1,8 @@
 import streamlit as st
 import numpy as np
-import pandas as pd
-import qrcode
 from io import BytesIO
+from vitals_kernel import METRICS, vitals_core
 from enum import Enum
-from PIL import Image
 import time
 
 # ==========================================
@@ -24,86 +22,116 @@ SPECIALIST_MAP = {
     "Nerve/Numbness": "Neurologist"
 }
 
-# Thresholds based on MIMIC-IV and Colab standards
-METRICS = ["heart_rate", "spo2", "pain_score"]
+# Patient instructions from Colab (rendered as one Markdown list)
+INSTRUCTIONS = (
+    "1. Sit or lie down and avoid all physical activity.",
+    "2. Sit upright or lean slightly forward to make breathing easier.",
+    "3. Monitor body temperature every 4–6 hours.",
+    "4. Do not stay alone in case symptoms worsen suddenly."
+)
+
+# Capacity of the per-session vitals ring buffer (one column per sample)
+MAX_VITALS_SAMPLES = 256
+
+_METRIC_TITLES = ("Heart Rate", "Spo2", "Pain Score")
+_WORSEN_REASONS = tuple(f"{title} is worsening over time." for title in _METRIC_TITLES)
+_RED_FLAG_REASONS = tuple(f"CRITICAL: {title} crossed safety limits." for title in _METRIC_TITLES)
+_METRICS_TABLE_HEADER = (
+    "| Metric | Trend | Critical Alert | Slope | Volatility | Window Mean | Window SD |\n"
+    "|---|---|---|---|---|---|---|\n"
+)
+
+# Shared across sessions and keyed on patient vitals, so keep it small and short-lived;
+# repeat renders within a session are served by the last_analysis memo instead
+@st.cache_data(max_entries=16, ttl="1h", show_spinner=False)
+def _analyze_cached(hr: tuple, spo2: tuple, pain: tuple) -> dict:
+    if not hr:
+        return {
+            "metrics_table": "",
+            "overall_status": "MONITOR",
+            "worsening_count": 0,
+            "red_flag_count": 0,
+            "reasons": []
+        }
+
+    is_worsening, red_flag, slopes, volatility, win_mean, win_std = vitals_core(
+        np.asarray(hr, dtype=np.float64),
+        np.asarray(spo2, dtype=np.float64),
+        np.asarray(pain, dtype=np.float64)
+    )
 
-SAFE_RANGES = {
-    "heart_rate": (60, 100),
-    "spo2": (95, 100),
-    "pain_score": (0, 3)
-}
-
-RED_FLAG_THRESHOLDS = {
-    "heart_rate": (40, 130),
-    "spo2": (0, 90),
-    "pain_score": (8, 10)
-}
-
-def calculate_slope(values):
-    """Calculates clinical deterioration velocity"""
-    if len(values) < 2: return 0.0
-    x = np.arange(len(values))
-    y = np.array(values)
-    slope, _ = np.polyfit(x, y, 1)
-    return float(slope)
-
-def patient_monitoring_pipeline_integrated(vitals_history):
-    metric_results = []
-    worsening_count = 0
-    red_flag_count = 0
     reasons = []
-    
-    for metric in METRICS:
-        data = vitals_history[metric]
-        if not data:
-            continue
-
-        current = data[-1]
-        baseline = data[0]
-        delta = current - baseline
-        slope = calculate_slope(data)
-
-        is_worsening = False
-
-        if metric == "spo2" and delta < -2:
-            is_worsening = True
-        elif metric == "pain_score" and delta > 2:
-            is_worsening = True
-        elif metric == "heart_rate" and delta > 5:
-            is_worsening = True
-
-        red_flag = (
-            current < RED_FLAG_THRESHOLDS[metric][0] or
-            current > RED_FLAG_THRESHOLDS[metric][1]
-        )
-
-        if is_worsening:
-            worsening_count += 1
-            reasons.append(f"{metric.replace('_', ' ').title()} is worsening over time.")
-
-        if red_flag:
-            red_flag_count += 1
-            reasons.append(
-                f"CRITICAL: {metric.replace('_', ' ').title()} crossed safety limits."
-            )
-
-        metric_results.append({
-            "Metric": metric.replace("_", " ").title(),
-            "Trend": "Worsening" if is_worsening else "Stable",
-            "Critical Alert": "YES ☢️" if red_flag else "No",
-            "Slope": round(slope, 2)
-        })
-
+    for i in np.where(is_worsening | red_flag)[0]:
+        if is_worsening[i]:
+            reasons.append(_WORSEN_REASONS[i])
+        if red_flag[i]:
+            reasons.append(_RED_FLAG_REASONS[i])
+
+    # Columnar formatting into one Markdown table: a single element, no DataFrame/Arrow round-trip
+    trends = ["Worsening" if w else "Stable" for w in is_worsening]
+    alerts = ["YES ☢️" if r else "No" for r in red_flag]
+    numbers = [
+        ["—" if np.isnan(x) else f"{x:.2f}" for x in column]  # NaN: skipped fit / too few samples
+        for column in (slopes, volatility, win_mean, win_std)
+    ]
+    metrics_table = _METRICS_TABLE_HEADER + "\n".join(
+        f"| {name} | {trend} | {alert} | {s} | {v} | {m} | {sd} |"
+        for name, trend, alert, s, v, m, sd in zip(_METRIC_TITLES, trends, alerts, *numbers)
+    )
+
+    worsening_count = int(is_worsening.sum())
+    red_flag_count = int(red_flag.sum())
     overall_status = "RED_FLAG" if (red_flag_count >= 1 or worsening_count >= 1) else "MONITOR"
 
     return {
-        "metrics": metric_results,
+        "metrics_table": metrics_table,
         "overall_status": overall_status,
         "worsening_count": worsening_count,
         "red_flag_count": red_flag_count,
         "reasons": reasons
     }
 
+def patient_monitoring_pipeline_integrated(vitals):
+    """Analyzes a (len(METRICS), n) slice of the vitals buffer"""
+    # Re-renders with the same vitals reuse the session's last result without hashing
+    # the arguments for st.cache_data; the raw bytes (<= 3 KB) identify the slice exactly
+    key = vitals.tobytes()
+    if st.session_state.get("last_analysis_key") != key:
+        # Tuples are hashable, so vitals seen before (any session) hit the st.cache_data entry
+        st.session_state["last_analysis"] = _analyze_cached(
+            tuple(vitals[0]), tuple(vitals[1]), tuple(vitals[2])
+        )
+        st.session_state["last_analysis_key"] = key
+    return st.session_state["last_analysis"]
+
+# Payloads carry patient details and the cache is shared across sessions, so keep it bounded
+@st.cache_data(max_entries=16, ttl="1h", show_spinner=False)
+def make_qr_svg(data: str) -> str:
+    """Encodes the hand-off payload as an SVG QR code (no PIL, no intermediate buffer)"""
+    # Imported lazily: only the final summary step needs segno
+    import segno
+    # make_qr forces a regular QR code; phone scanners often can't read Micro QR
+    # "l" is only the minimum level: segno's default boost_error raises it (e.g. to M)
+    # whenever that fits in the same version, so the matrix size is unchanged
+    qr = segno.make_qr(data, error="l")
+    # st.image only recognises SVG markup passed as a string. light= paints the light
+    # modules and quiet zone; segno leaves them transparent by default, which is
+    # unscannable on a dark theme
+    return qr.svg_inline(scale=4, light="#fff")
+
+# Shared across sessions, so keep it bounded: patient photos shouldn't outlive their triage
+@st.cache_resource(max_entries=16, ttl="1h", show_spinner=False)
+def _decode_image(file_id: str, _data: bytes):
+    """Decodes an uploaded wound photo once; repeat displays reuse the PIL image"""
+    # Keyed on the upload's file_id only; the leading underscore keeps Streamlit from
+    # hashing the full image bytes on every rerun
+    # Imported lazily: only the photo step and the Clinician Portal need PIL
+    from PIL import Image
+    img = Image.open(BytesIO(_data)).convert("RGB")
+    # Cap the display copy at ~1 MP so each rerun re-encodes far fewer pixels
+    img.thumbnail((1024, 1024), Image.Resampling.LANCZOS)
+    return img
+
 
 # ==========================================
 # SECTION 2: APP INITIALIZATION & STATE
@@ -111,6 +139,18 @@ def patient_monitoring_pipeline_integrated(vitals_history):
 
 st.set_page_config(page_title="Triage AI Navigator", page_icon="🚑", layout="wide")
 
+@st.cache_resource
+def _warm_core():
+    # JIT-compile (or load from the numba cache) once per process, not on the first triage;
+    # vitals_core lives in an imported module, so the warmed dispatcher survives reruns
+    vitals_core(np.zeros(2), np.zeros(2), np.zeros(2))
+
+_warm_core()
+
+def new_vitals_buffer():
+    # SoA ring buffer: row per metric (METRICS order), filled left to right up to "vitals_n"
+    return np.full((len(METRICS), MAX_VITALS_SAMPLES), np.nan, dtype=np.float32)
+
 if "current_page" not in st.session_state:
     st.session_state.current_page = "Home"
 if "step" not in st.session_state:
@@ -119,9 +159,11 @@ if "data" not in st.session_state:
     st.session_state.data = {
         "patient_info": {"name": "Anonymous", "age": "N/A"},
         "rf": {"airway": "No", "bleed": "No"},
-        "vitals_history": {"heart_rate": [],"spo2": [],"pain_score": []},
+        "vitals": new_vitals_buffer(),
+        "vitals_n": 0,
         "esi": {"worsening": "No"},
         "photo": None,
+        "photo_bytes": None,
         "main_symptom": "Wound/Skin"
     }
 
@@ -130,6 +172,55 @@ if "data" not in st.session_state:
 # SECTION 3: PAGES
 # ==========================================
 
+def render_final_summary():
+    # Step 5 result view (read-only; the Finish button is rendered by the caller)
+    d = st.session_state.data
+    vitals = d["vitals"][:, :d["vitals_n"]]
+    analysis = patient_monitoring_pipeline_integrated(vitals)
+    
+    # Bind the fields shared by the summary and the QR payload once
+    name = d["patient_info"]["name"]
+    age = d["patient_info"]["age"]
+    spec = SPECIALIST_MAP[d["main_symptom"]]
+    status = analysis["overall_status"]
+
+    # Extract latest vitals
+    latest_hr = int(vitals[0, -1]) if d["vitals_n"] else "N/A"
+    latest_spo = int(vitals[1, -1]) if d["vitals_n"] else "N/A"
+    
+    # UI Styling from Colab Output
+    if status == "RED_FLAG":
+        st.error("## STATUS: ☢️ Immediate Attention Required")
+    else:
+        st.success("## STATUS: 🟢 Under Monitoring")
+        
+    col_a, col_b = st.columns(2)
+    with col_a:
+        st.write(f"**Patient:** {name} (Age: {age})")
+        st.write(f"**Specialist:** {spec}")
+    with col_b:
+        st.write(f"**Worsening Metrics:** {analysis['worsening_count']}")
+        st.write(f"**Red Flags:** {analysis['red_flag_count']}")
+
+    st.subheader("⚠️ Why this status was assigned")
+    if analysis["reasons"]:
+        st.markdown("\n".join(f"- {r}" for r in analysis["reasons"]))
+
+    # Instructions from Colab
+    st.subheader("📋 Patient Instructions")
+    st.markdown("\n".join(INSTRUCTIONS))
+
+    # QR Bridge: N=name, A=age, S=status, R=referral, V=HR bpm,SpO2 %, P=photo (1/0)
+    # Short keys keep the payload (and so the QR matrix) small
+    qr_data = f"N:{name}|A:{age}|S:{status}|R:{spec}|V:{latest_hr},{latest_spo}|P:{1 if d['photo'] else 0}"
+    # The SVG scales losslessly, so size it for scanning rather than by its 4-unit modules
+    st.image(make_qr_svg(qr_data), width=240, caption="Nurse: Scan to view full profile and photo")
+
+def go_home():
+    # Button callback: runs before the rerun, so the page being left is never re-rendered
+    st.session_state.step = 0
+    st.session_state.current_page = "Home"
+
 if st.session_state.current_page == "Home":
     st.title("🏥 Triage AI: The Rural Healthcare Bridge")
     st.info("Multimodal Clinical Navigator")
@@ -148,11 +239,14 @@ if st.session_state.current_page == "Home":
     with col2:
         if st.button("🚀 Hourly Checkup (Simulate)", width="stretch"):
             st.session_state.data["patient_info"] = {"name": "Simulated Patient", "age": "45"}
-            st.session_state.data["vitals_history"] = {
-                "heart_rate": [75, 82, 95, 110, 125, 135],
-                "spo2": [98, 97, 95, 92, 89, 87],
-                "pain_score": [2, 3, 5, 7, 8, 9]
-            }
+            vitals = new_vitals_buffer()
+            vitals[:, :6] = [
+                [75, 82, 95, 110, 125, 135],  # heart_rate
+                [98, 97, 95, 92, 89, 87],  # spo2
+                [2, 3, 5, 7, 8, 9]  # pain_score
+            ]
+            st.session_state.data["vitals"] = vitals
+            st.session_state.data["vitals_n"] = 6
             st.session_state.data["main_symptom"] = "Breathing Issue"
             st.toast("Simulation Loaded", icon="⚠️")
             st.session_state.current_page = "Clinician Portal"
@@ -161,7 +255,7 @@ if st.session_state.current_page == "Home":
     st.divider()
     st.markdown("""
     ### Why Triage AI?
-    - **Trend Analysis:** Uses polyfit slopes to catch deterioration before thresholds are hit.
+    - **Trend Analysis:** Uses least-squares slopes to catch deterioration before thresholds are hit.
     - **Dynamic Bypassing:** Only triggers wound assessment for relevant injuries.
     - **Clinician Bridge:** QR-encoded data hand-off for rural health workers.
     """)
@@ -182,9 +276,12 @@ elif st.session_state.current_page == "Patient Triage":
     # STEP 0: REGISTRATION
     if st.session_state.step == 0:
         st.header("Step 0: Patient Registration")
-        name = st.text_input("Patient Full Name", value=st.session_state.data["patient_info"]["name"])
-        age = st.text_input("Age", value=st.session_state.data["patient_info"]["age"])
-        if st.button("Begin Assessment"):
+        # Forms commit widget values on submit only, so editing a field doesn't rerun the script
+        with st.form("registration"):
+            name = st.text_input("Patient Full Name", value=st.session_state.data["patient_info"]["name"])
+            age = st.text_input("Age", value=st.session_state.data["patient_info"]["age"])
+            submit = st.form_submit_button("Begin Assessment")
+        if submit:
             st.session_state.data["patient_info"] = {"name": name, "age": age}
             st.session_state.step = 1
             st.rerun()
@@ -192,9 +289,11 @@ elif st.session_state.current_page == "Patient Triage":
     # STEP 1: SAFETY
     elif st.session_state.step == 1:
         st.header("Step 1: Immediate Safety Check")
-        q1 = st.radio("Difficulty breathing?", ["No", "Yes", "Not Sure"], horizontal=True)
-        q2 = st.radio("Severe bleeding?", ["No", "Yes", "Not Sure"], horizontal=True)
-        if st.button("Continue"):
+        with st.form("rf"):
+            q1 = st.radio("Difficulty breathing?", ["No", "Yes", "Not Sure"], horizontal=True)
+            q2 = st.radio("Severe bleeding?", ["No", "Yes", "Not Sure"], horizontal=True)
+            submit = st.form_submit_button("Continue")
+        if submit:
             st.session_state.data["rf"] = {"airway": q1, "bleed": q2}
             st.session_state.step = 2
             st.rerun()
@@ -202,22 +301,31 @@ elif st.session_state.current_page == "Patient Triage":
     # STEP 2: VITALS
     elif st.session_state.step == 2:
         st.header("Step 2: Vitals")
-        hr = st.number_input("Current Heart Rate (BPM)", 30, 200, 75)
-        spo2 = st.number_input("Current Oxygen Level (%)", 50, 100, 98)
-        pain = st.select_slider("Pain Level (0 = None, 10 = Severe)", options=range(11))
-        if st.button("Next"):
-            st.session_state.data["vitals_history"]["heart_rate"].append(hr)
-            st.session_state.data["vitals_history"]["spo2"].append(spo2)
-            st.session_state.data["vitals_history"]["pain_score"].append(pain)
+        with st.form("vitals"):
+            hr = st.number_input("Current Heart Rate (BPM)", 30, 200, 75)
+            spo2 = st.number_input("Current Oxygen Level (%)", 50, 100, 98)
+            pain = st.select_slider("Pain Level (0 = None, 10 = Severe)", options=range(11))
+            submit = st.form_submit_button("Next")
+        if submit:
+            vitals = st.session_state.data["vitals"]
+            n = st.session_state.data["vitals_n"]
+            if n == MAX_VITALS_SAMPLES:
+                # Buffer full: drop the oldest sample so columns stay in time order
+                vitals[:, :-1] = vitals[:, 1:]
+                n -= 1
+            vitals[:, n] = (hr, spo2, pain)
+            st.session_state.data["vitals_n"] = n + 1
             st.session_state.step = 3
             st.rerun()
 
     # STEP 3: CONTEXT
     elif st.session_state.step == 3:
         st.header("Step 3: Context")
-        symp = st.selectbox("Primary Concern:", list(SPECIALIST_MAP.keys()))
-        c1 = st.radio("Is it worsening rapidly?", ["No", "Yes", "Not Sure"], horizontal=True)
-        if st.button("Analyze Flow"):
+        with st.form("context"):
+            symp = st.selectbox("Primary Concern:", list(SPECIALIST_MAP.keys()))
+            c1 = st.radio("Is it worsening rapidly?", ["No", "Yes", "Not Sure"], horizontal=True)
+            submit = st.form_submit_button("Analyze Flow")
+        if submit:
             st.session_state.data["main_symptom"] = symp
             st.session_state.data["esi"] = {"worsening": c1}
             st.session_state.step = 4 if symp in ["Wound/Skin", "Fever/Infection"] else 5
@@ -228,8 +336,9 @@ elif st.session_state.current_page == "Patient Triage":
         st.header("Step 4: Medetec Wound Analysis")
         up_file = st.file_uploader("Upload Image", type=["jpg", "png"])
         if up_file:
-            st.image(Image.open(up_file), width="stretch")
             st.session_state.data["photo"] = up_file
+            st.session_state.data["photo_bytes"] = up_file.getvalue()
+            st.image(_decode_image(up_file.file_id, st.session_state.data["photo_bytes"]), width="stretch", output_format="JPEG")
         if st.button("Complete"):
             st.session_state.step = 5
             st.rerun()
@@ -237,54 +346,8 @@ elif st.session_state.current_page == "Patient Triage":
     # STEP 5: FINAL RESULT (Patient View)
     elif st.session_state.step == 5:
         st.header("Final Triage Summary")
-        d = st.session_state.data
-        analysis = patient_monitoring_pipeline_integrated(d["vitals_history"])
-        
-        # Extract latest vitals
-        latest_hr = d["vitals_history"]["heart_rate"][-1] if d["vitals_history"]["heart_rate"] else "N/A"
-        latest_spo = d["vitals_history"]["spo2"][-1] if d["vitals_history"]["spo2"] else "N/A"
-        
-        # UI Styling from Colab Output
-        if analysis["overall_status"] == "RED_FLAG":
-            st.error("## STATUS: ☢️ Immediate Attention Required")
-        else:
-            st.success("## STATUS: 🟢 Under Monitoring")
-            
-        col_a, col_b = st.columns(2)
-        with col_a:
-            st.write(f"**Patient:** {d['patient_info']['name']} (Age: {d['patient_info']['age']})")
-            st.write(f"**Specialist:** {SPECIALIST_MAP[d['main_symptom']]}")
-        with col_b:
-            st.write(f"**Worsening Metrics:** {analysis['worsening_count']}")
-            st.write(f"**Red Flags:** {analysis['red_flag_count']}")
-
-        st.subheader("⚠️ Why this status was assigned")
-        for reason in analysis["reasons"]:
-            st.write(f"- {reason}")
-
-        # Instructions from Colab
-        st.subheader("📋 Patient Instructions")
-        st.write("1. Sit or lie down and avoid all physical activity.")
-        st.write("2. Sit upright or lean slightly forward to make breathing easier.")
-        st.write("3. Monitor body temperature every 4–6 hours.")
-        st.write("4. Do not stay alone in case symptoms worsen suddenly.")
-
-        # QR Bridge
-        qr_data = (f"NAME:{d['patient_info']['name']}|"
-                   f"AGE:{d['patient_info']['age']}|"
-                   f"STATUS:{analysis['overall_status']}|"
-                   f"SPECIALIST:{SPECIALIST_MAP[d['main_symptom']]}|"
-                   f"VITALS:{latest_hr}bpm,{latest_spo}%|"
-                   f"PHOTO_REF:{'AVAILABLE' if d['photo'] else 'NONE'}")
-        qr_img = qrcode.make(qr_data)
-        buf = BytesIO()
-        qr_img.save(buf)
-        st.image(buf.getvalue(), width="content", caption="Nurse: Scan to view full profile and photo")
-        
-        if st.button("Finish", width="stretch"):
-            st.session_state.step = 0
-            st.session_state.current_page = "Home"
-            st.rerun()
+        render_final_summary()
+        st.button("Finish", width="stretch", on_click=go_home)
 
 # ==========================================
 # SECTION 4: CLINICIAN PORTAL (Backend Output View)
@@ -293,13 +356,11 @@ elif st.session_state.current_page == "Patient Triage":
 elif st.session_state.current_page == "Clinician Portal":
     st.title("👨‍⚕️ Clinician Data Bridge")
 
-    if st.button("⬅ Back to Home"):
-        st.session_state.step = 0
-        st.session_state.current_page = "Home"
-        st.rerun()
+    st.button("⬅ Back to Home", on_click=go_home)
     
     d = st.session_state.data
-    analysis = patient_monitoring_pipeline_integrated(d["vitals_history"])
+    vitals = d["vitals"][:, :d["vitals_n"]]
+    analysis = patient_monitoring_pipeline_integrated(vitals)
     
     st.info(f"📋 **Patient Profile:** {d['patient_info']['name']} | **Age:** {d['patient_info']['age']}")
     
@@ -309,23 +370,23 @@ elif st.session_state.current_page == "Clinician Portal":
     col_v3.warning(f"**Route to:** {SPECIALIST_MAP[d['main_symptom']]}")
 
     st.subheader("📈 Trend Analysis (Colab Backend Output)")
-    df = pd.DataFrame({"Heart Rate": d["vitals_history"]["heart_rate"], "SpO2": d["vitals_history"]["spo2"]})
-    st.line_chart(df, width="stretch")
+    # st.line_chart takes a dict of columns directly; no DataFrame construction needed
+    chart_data = {"Heart Rate": vitals[0], "SpO2": vitals[1]}
+    st.line_chart(chart_data, width="stretch")
 
     # Photo and Problem Summary
     st.divider()
     c1, c2 = st.columns(2)
     with c1:
         st.subheader("🔬 Detailed Metric Analysis")
-        st.table(analysis["metrics"])
+        st.markdown(analysis["metrics_table"])
         if d["photo"]:
-            st.image(Image.open(d["photo"]), width="stretch", caption="Hand-off Visual Data")
+            st.image(_decode_image(d["photo"].file_id, d["photo_bytes"]), width="stretch", caption="Hand-off Visual Data", output_format="JPEG")
             
     with c2:
         st.subheader("💡 Why this was flagged?")
         if analysis["reasons"]:
-            for r in analysis["reasons"]:
-                st.write(f"- {r}")
+            st.markdown("\n".join(f"- {r}" for r in analysis["reasons"]))
         else:
             st.write("- No critical deterioration detected at this time.")
 
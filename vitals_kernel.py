@@ -0,0 +1,90 @@
+import numpy as np
+import numba
+from window_ops.rolling import rolling_mean, rolling_std
+
+# ==========================================
+# VITALS KERNEL: numba-compiled numeric core
+# ==========================================
+# Kept out of streamlit_app.py: Streamlit re-executes the script on every rerun, which
+# would rebuild these dispatchers each time. An imported module lives in sys.modules,
+# so the kernel is compiled (or loaded from the numba cache) once per process.
+
+# Thresholds based on MIMIC-IV and Colab standards
+METRICS = ["heart_rate", "spo2", "pain_score"]
+
+# Rolling-window length in samples (6 hourly checkups = 6 h)
+TREND_WINDOW = 6
+
+SAFE_RANGES = {
+    "heart_rate": (60, 100),
+    "spo2": (95, 100),
+    "pain_score": (0, 3)
+}
+
+RED_FLAG_THRESHOLDS = {
+    "heart_rate": (40, 130),
+    "spo2": (0, 90),
+    "pain_score": (8, 10)
+}
+
+# Per-metric lookups baked once at import, in METRICS order
+# (float64 to match the kernel inputs; numba freezes them as compile-time constants)
+# Worsening: HR rises > 5, SpO2 drops > 2, pain rises > 2
+_WORSEN_SIGN = np.array([1, -1, 1], dtype=np.float64)
+_WORSEN_THR = np.array([5, 2, 2], dtype=np.float64)
+_RF_LO = np.array([RED_FLAG_THRESHOLDS[metric][0] for metric in METRICS], dtype=np.float64)
+_RF_HI = np.array([RED_FLAG_THRESHOLDS[metric][1] for metric in METRICS], dtype=np.float64)
+
+@numba.njit(cache=True)
+def _window_features(arr, w=TREND_WINDOW):
+    """Rolling mean and standard deviation over the trailing w samples"""
+    # Partial windows are allowed so short histories still get features (SD needs 2 samples)
+    return rolling_mean(arr, w, min_samples=1), rolling_std(arr, w, min_samples=2)
+
+@numba.njit(cache=True, inline="always")
+def _metric_pass(y, sign, thr, lo, hi):
+    """One metric's fused pass: worsening, red flag, slope, volatility, window mean and SD"""
+    n = y.shape[0]
+    current = y[n - 1]
+    worsening = sign * (current - y[0]) > thr
+    red = current < lo or current > hi
+    slope = 0.0
+    volatility = 0.0
+    if red:
+        # A red flag already decides the status, so skip the trend fit (reported as NaN)
+        slope = np.nan
+        volatility = np.nan
+    elif n >= 2:
+        # Least-squares slope against x = 0..n-1 in closed form:
+        # slope = (12*sum(i*y) - 6*(n-1)*sum(y)) / (n*(n^2-1))
+        sum_y = 0.0
+        sum_iy = 0.0
+        for i in range(n):
+            sum_y += y[i]
+            sum_iy += i * y[i]
+        slope = (12.0 * sum_iy - 6.0 * (n - 1) * sum_y) / (n * (n * n - 1.0))
+        # Volatility: RMS of the residuals around the fitted line (linear detrend)
+        intercept = sum_y / n - slope * (n - 1) / 2.0
+        sum_sq = 0.0
+        for i in range(n):
+            r = y[i] - (intercept + slope * i)
+            sum_sq += r * r
+        volatility = np.sqrt(sum_sq / n)
+    means, stds = _window_features(y)
+    return worsening, red, slope, volatility, means[n - 1], stds[n - 1]
+
+@numba.njit(cache=True)
+def vitals_core(hr, spo2, pain):
+    """Fused numeric pass over the three METRICS, unrolled with each metric's rules inlined"""
+    # Global arrays are compile-time constants, so every call below is specialized
+    a = _metric_pass(hr, _WORSEN_SIGN[0], _WORSEN_THR[0], _RF_LO[0], _RF_HI[0])
+    b = _metric_pass(spo2, _WORSEN_SIGN[1], _WORSEN_THR[1], _RF_LO[1], _RF_HI[1])
+    c = _metric_pass(pain, _WORSEN_SIGN[2], _WORSEN_THR[2], _RF_LO[2], _RF_HI[2])
+    return (
+        np.array([a[0], b[0], c[0]]),
+        np.array([a[1], b[1], c[1]]),
+        np.array([a[2], b[2], c[2]]),
+        np.array([a[3], b[3], c[3]]),
+        np.array([a[4], b[4], c[4]]),
+        np.array([a[5], b[5], c[5]])
+    )